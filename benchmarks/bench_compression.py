@@ -0,0 +1,67 @@
+"""
+    Benchmark: disk size and read time of raw data files stored plain or compressed
+    files are generated with synthetic.py, compressed with utils.compressFile and read back
+    through Cleaner._readFile (decompressing); break-even is the storage bandwidth below which
+    reading the compressed files is faster than reading plain text
+    python benchmarks/bench_compression.py [n_weeks] [n_devices] [directory]
+    directory defaults to a temporary one, point it at network storage to measure there
+    (page cache is not dropped, repeated runs read from memory)
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pymtattl import Cleaner
+from pymtattl.utils import compressFile, zstandard
+from synthetic import writeFiles
+
+
+def readAll(clean, names):
+    """read every file through the cleaner, return seconds"""
+    start = time.perf_counter()
+    for name in names:
+        clean._readFile(name)
+    return time.perf_counter() - start
+
+
+def main(n_weeks=8, n_devices=4000, directory=None):
+    logging.disable(logging.WARNING)
+    root = directory or tempfile.mkdtemp()
+    plain = writeFiles(os.path.join(root, 'plain', 'download'), '2014-10-04', int(n_weeks), int(n_devices))
+    compressions = [None, 'gzip', 'xz'] + (['zstd'] if zstandard is not None else [])
+    results = []
+    for compression in compressions:
+        path = os.path.join(root, compression or 'plain')
+        if compression:
+            shutil.copytree(os.path.join(root, 'plain', 'download'), os.path.join(path, 'download'))
+        start = time.perf_counter()
+        if compression:
+            for p in plain:
+                compressFile(os.path.join(path, 'download', os.path.basename(p)), compression)
+        seconds_compress = time.perf_counter() - start
+        clean = Cleaner(directory=path)
+        names = sorted(os.listdir(clean._input_path))
+        size = sum(os.path.getsize(os.path.join(clean._input_path, n)) for n in names)
+        results.append((compression or 'plain', size, seconds_compress, readAll(clean, names)))
+
+    print("{:>8} {:>10} {:>8} {:>12} {:>10} {:>16}".format(
+        'storage', 'MB', 'ratio', 'compress(s)', 'read(s)', 'break-even MB/s'))
+    _, plain_size, _, plain_read = results[0]
+    for name, size, seconds_compress, seconds_read in results:
+        # plain: plain_size / bw + plain_read, compressed: size / bw + seconds_read
+        extra = seconds_read - plain_read
+        even = (plain_size - size) / 2**20 / extra if name != 'plain' and extra > 0 else float('nan')
+        print("{:>8} {:>10.1f} {:>8.2f} {:>12.2f} {:>10.3f} {:>16.1f}".format(
+            name, size / 2**20, plain_size / size, seconds_compress, seconds_read, even))
+    if directory is None:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
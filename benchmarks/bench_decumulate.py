@@ -0,0 +1,81 @@
+"""
+    Benchmark: NumPy decumulate kernel (clean.diffReadings) against the original pandas steps
+    python benchmarks/bench_decumulate.py [n_devices] [n_weeks]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pymtattl.clean import diffReadings
+
+
+def makeFrame(n_devices, n_weeks, seed=0):
+    """cumulative readings every 4 hours with backwards counts, alternating jumps and resets"""
+    rnd = np.random.RandomState(seed)
+    n = 42 * n_weeks
+    frames = []
+    for d in range(1, n_devices + 1):
+        entry = rnd.randint(0, 10 ** 7) + np.cumsum(rnd.randint(0, 600, n))
+        exit = rnd.randint(0, 10 ** 7) + np.cumsum(rnd.randint(0, 500, n))
+        kind = d % 4
+        if kind == 1:
+            entry = entry[0] - (entry - entry[0]) # counting backwards
+        elif kind == 2:
+            entry[1::2] += 80000 # every second record off
+            exit[1::2] += 8000
+        elif kind == 3:
+            entry[n // 2:] -= entry[n // 2] # reset
+        frames.append(pd.DataFrame({
+            'timestamp': 1500000000 + 14400 * np.arange(n),
+            'description': 'REGULAR',
+            'entry': entry,
+            'exit': exit,
+            'device_id': d,
+            'file_date': 170902 + np.arange(n) // 42 * 7, # not real dates, only used as week keys
+        }))
+    return pd.concat(frames, ignore_index=True).sample(frac=1, random_state=seed)
+
+
+def splitDiff(df, threshold, col, gbcol):
+    """original splitDiff"""
+    df1 = df[df[col] < threshold].copy()
+    df2 = df[df[col] >= threshold].copy()
+    df2[col] = df2.groupby(gbcol)[col].diff().abs()
+    return pd.concat([df1, df2], axis=0).sort_index()
+
+
+def referenceDiff(df):
+    """original pandas decumulate steps"""
+    group = ['device_id', 'file_date']
+    df = df.sort_values(['device_id', 'file_date', 'timestamp']).reset_index(drop=True)
+    df.loc[:, ['entry', 'exit']] = df.groupby(group)[['entry', 'exit']].diff().abs()
+    df.dropna(axis=0, how='any', inplace=True)
+    df = splitDiff(df, 7000, 'entry', group)
+    df = splitDiff(df, 6000, 'exit', group)
+    df.dropna(axis=0, how='any', inplace=True)
+    df.drop(df[(df['entry'] >= 7000) | (df['exit'] >= 6000)].index, inplace=True)
+    return df.sort_values('file_date', kind='mergesort').reset_index(drop=True)
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(n_devices=5000, n_weeks=2):
+    df = makeFrame(n_devices, n_weeks)
+    ref, t_ref = timeit(referenceDiff, df)
+    new, t_new = timeit(diffReadings, df)
+    pd.testing.assert_frame_equal(ref, new, check_dtype=False) # entry/exit are int32 since the compact schema
+    print("{:>10} {:>10} {:>10} {:>10} {:>8}".format('readings', 'kept', 'pandas(s)', 'numpy(s)', 'speedup'))
+    print("{:>10} {:>10} {:>10.3f} {:>10.3f} {:>7.1f}x".format(len(df), len(new), t_ref, t_new, t_ref / t_new))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,53 @@
+"""
+    Benchmark: memory per million readings of the frames built by Cleaner,
+    object/int64 frames of the original parser against the compact typed frames
+    python benchmarks/bench_memory.py [n_devices] [n_days]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import sys
+import logging
+import tempfile
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pymtattl import Cleaner
+from pymtattl.clean import decumulate
+from pymtattl.sqlalchemy_declarative import DimensionCache, create_all_table
+from synthetic import makeLines
+from bench_parse import referenceProcess, ANOMALIES
+
+
+def perMillion(df):
+    """deep memory usage in MB per million rows, index included"""
+    return df.memory_usage(deep=True, index=True).sum() / 2**20 / len(df) * 10**6
+
+
+def main(n_devices=2000, n_days=7):
+    logging.disable(logging.WARNING)
+    directory = tempfile.mkdtemp()
+    clean = Cleaner(directory=directory)
+    cache = DimensionCache(create_all_table('sqlite:///' + os.path.join(directory, 'bench.db')))
+    datevalue = 181006
+    data = makeLines(datevalue, n_devices, n_days, anomalies=ANOMALIES)
+
+    ref = referenceProcess(clean.logger, data, datevalue)
+    ref_loaded = ref.join(cache.resolve(ref.index.unique())).reset_index(drop=True)
+    ref_loaded['file_date'] = datevalue
+    new = clean._process(data, datevalue)
+    loaded = clean._load('turnstile_{}.txt'.format(datevalue), new.copy(), cache)
+    empty = pd.DataFrame(columns=['device_id', 'timestamp', 'description', 'entry', 'exit', 'file_date'])
+    # original decumulated frames keep the same columns, entry/exit become float64 after diff
+    ref_out = ref_loaded.astype({'entry': float, 'exit': float})
+    out, _ = decumulate(loaded, empty)
+
+    print("{:>24} {:>14} {:>14}".format('MB per million readings', 'original', 'compact'))
+    for stage, a, b in [('parsed (_process)', ref, new),
+                        ('indexed (_load)', ref_loaded, loaded),
+                        ('decumulated', ref_out, out)]:
+        print("{:>24} {:>14.1f} {:>14.1f}".format(stage, perMillion(a), perMillion(b)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,86 @@
+"""
+    Benchmark: vectorized Cleaner._process against the original per-line parser
+    python benchmarks/bench_parse.py [n_devices] [n_days]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import sys
+import time
+import logging
+import tempfile
+import pandas as pd
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pymtattl import Cleaner
+import synthetic
+
+# the original parser stops at empty counts, leave them out
+ANOMALIES = tuple(a for a in synthetic.ANOMALIES if a != 'empty')
+
+
+def processRow(logger, filename, cols, i, j):
+    """original per-row parser, kept here as the reference implementation"""
+    timestamp = cols[j] + " " + cols[j+1]
+    try:
+        timestamp = datetime.strptime(timestamp, '%m-%d-%y %H:%M:%S')
+    except ValueError:
+        try:
+            timestamp = datetime.strptime(timestamp, '%m/%d/%Y %H:%M:%S')
+        except ValueError:
+            logger.warning('File {0} line {1} column {2}: Incorrect datetime format ({3}).'.format(filename, i, j, timestamp))
+            return None
+    timestamp = int((timestamp - datetime(1970, 1, 1)) / timedelta(seconds=1))
+    return tuple(cols[:3] + [timestamp, cols[j+2], int(cols[j+3]), int(cols[j+4])])
+
+
+def referenceProcess(logger, data, datevalue):
+    """original Cleaner._process loop"""
+    rows = []
+    for i, line in enumerate(data):
+        if datevalue >= 141018 and i == 0:
+            continue
+        cols = line.replace('\x00', '').strip().split(',')
+        ncol = len(cols)
+        if datevalue < 141018:
+            if (ncol - 3) % 5 > 0:
+                logger.warning('File {0} line{1}: Incorrect number of columns ({2}).'.format(datevalue, i, ncol))
+            else:
+                for j in range(3, ncol, 5):
+                    row = processRow(logger, datevalue, cols, i, j)
+                    if row:
+                        rows.append(row)
+        else:
+            if ncol != 11:
+                logger.warning('File {0} line{1}: Incorrect number of columns ({2}).'.format(datevalue, i, ncol))
+            else:
+                row = processRow(logger, datevalue, cols, i, 6)
+                if row:
+                    rows.append(row)
+    labels = ['ca', 'unit', 'scp', 'timestamp', 'description', 'entry', 'exit']
+    df = pd.DataFrame.from_records(rows, columns=labels)
+    return df.sort_values(by=['ca', 'unit', 'scp', 'timestamp']).set_index(['ca', 'unit', 'scp'])
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(n_devices=2000, n_days=7):
+    logging.disable(logging.WARNING)
+    clean = Cleaner(directory=tempfile.mkdtemp())
+    print("{:>8} {:>10} {:>12} {:>12} {:>8}".format('format', 'readings', 'per-line(s)', 'vector(s)', 'speedup'))
+    for datevalue in (140906, 181006):
+        data = synthetic.makeLines(datevalue, n_devices, n_days, anomalies=ANOMALIES)
+        ref, t_ref = timeit(referenceProcess, clean.logger, data, datevalue)
+        new, t_new = timeit(clean._process, data, datevalue)
+        pd.testing.assert_frame_equal(ref, new.astype({'description': object}))
+        print("{:>8} {:>10} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+            'wide' if datevalue < 141018 else 'narrow', len(new), t_ref, t_new, t_ref / t_new))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
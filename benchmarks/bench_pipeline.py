@@ -0,0 +1,89 @@
+"""
+    Benchmark: download -> clean -> store pipeline on synthetic data, stage by stage
+    files are generated with synthetic.py (wide and narrow layouts, with anomalies),
+    downloaded from a local server (serve.py), then parsed, resolved to devices,
+    decumulated and written to a temporary sqlite database
+    python benchmarks/bench_pipeline.py [n_weeks] [n_devices ...]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import sys
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pymtattl import Cleaner, Downloader
+from pymtattl.clean import decumulate
+from pymtattl.sqlalchemy_declarative import DimensionCache, read_previous, upsert_previous
+from synthetic import writeFiles
+from serve import serveDirectory
+
+START_DATE = '2014-10-04' # two wide files, then narrow ones
+STAGES = ['download', 'parse', 'resolve', 'decumulate', 'write']
+
+
+def download(source, directory, n_weeks):
+    """fetch all files of source through a local server, return seconds"""
+    server, url = serveDirectory(source)
+    try:
+        start = time.perf_counter()
+        Downloader(directory=directory, url=url).run(date_range=('2000-01-01', '2099-12-31'), concurrency=4)
+        return time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+
+def runStages(n_weeks, n_devices):
+    """return {stage: seconds}, readings parsed, readings written and bytes of the data files"""
+    root = tempfile.mkdtemp()
+    paths = writeFiles(os.path.join(root, 'source'), START_DATE, n_weeks, n_devices)
+    seconds = dict.fromkeys(STAGES, 0.0)
+    seconds['download'] = download(os.path.join(root, 'source'), root, n_weeks)
+
+    clean = Cleaner(directory=root, dbstring='sqlite:///' + os.path.join(root, 'bench.db'))
+    engine, writer = clean._configDB()
+    cache = DimensionCache(engine)
+    n_in, n_out = 0, 0
+    for path in paths:
+        url = os.path.basename(path)
+        start = time.perf_counter()
+        df = clean._process(*clean._readFile(url))
+        seconds['parse'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        df = clean._load(url, df, cache)
+        seconds['resolve'] += time.perf_counter() - start
+
+        with engine.begin() as conn:
+            df_prev = read_previous(conn, df['device_id'].unique())
+            start = time.perf_counter()
+            out, df_prev_new = decumulate(df, df_prev)
+            seconds['decumulate'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            writer.write(conn, out)
+            seconds['write'] += time.perf_counter() - start
+            upsert_previous(conn, df_prev_new)
+        n_in, n_out = n_in + len(df), n_out + len(out)
+    engine.dispose()
+    return seconds, n_in, n_out, sum(os.path.getsize(p) for p in paths)
+
+
+def main(n_weeks=4, *sizes):
+    logging.disable(logging.WARNING)
+    sizes = [int(s) for s in sizes] or [500, 2000, 8000]
+    print("{:>8} {:>10} {:>8} {:>12} {:>10} {:>14}".format('devices', 'readings', 'MB', 'stage', 'seconds', 'rate'))
+    for n_devices in sizes:
+        seconds, n_in, n_out, size = runStages(int(n_weeks), n_devices)
+        for s in STAGES:
+            if s == 'download':
+                rate = "{:.1f} MB/s".format(size / 2**20 / seconds[s])
+            else:
+                rate = "{:.0f} rows/s".format((n_out if s == 'write' else n_in) / seconds[s])
+            print("{:>8} {:>10} {:>8.1f} {:>12} {:>10.3f} {:>14}".format(n_devices, n_in, size / 2**20, s, seconds[s], rate))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,71 @@
+"""
+    Benchmark: turnstile bulk writers, rows/sec per backend
+    python benchmarks/bench_writers.py [n_rows] [dbstring ...]
+    sqlite is always measured in a temporary file, extra dbstrings (e.g. postgresql) are
+    written to as well, so point them at a scratch database
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pymtattl.sqlalchemy_declarative import Turnstile, create_all_table
+from pymtattl.writers import WRITERS, get_writer
+
+
+def makeFrame(n_rows, seed=0):
+    """decumulated frame as produced by clean.decumulate (entry/exit are floats after diff)"""
+    rnd = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'timestamp': 1500000000 + 14400 * np.arange(n_rows),
+        'description': np.where(rnd.rand(n_rows) < 0.99, 'REGULAR', 'RECOVR AUD'),
+        'entry': rnd.randint(0, 7000, n_rows).astype(float),
+        'exit': rnd.randint(0, 6000, n_rows).astype(float),
+        'device_id': rnd.randint(1, 5000, n_rows),
+        'file_date': 170902,
+    })
+
+
+def recordsInsert(conn, df):
+    """original path: dict per row through the sqlalchemy insert"""
+    columns = [c.name for c in Turnstile.__table__.columns if c.name != 'id']
+    conn.execute(Turnstile.__table__.insert(), df[columns].to_dict(orient='records'))
+
+
+def measure(dbstring, name, df):
+    engine = create_all_table(dbstring)
+    writer = get_writer(engine, name) if name else None
+    engine.dispose()
+    with engine.begin() as conn:
+        conn.execute(Turnstile.__table__.delete())
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        if writer:
+            writer.write(conn, df)
+        else:
+            recordsInsert(conn, df)
+    seconds = time.perf_counter() - start
+    engine.dispose()
+    return seconds
+
+
+def main(n_rows=500000, *dbstrings):
+    df = makeFrame(int(n_rows))
+    targets = [('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'), ['generic', 'sqlite'])]
+    for d in dbstrings:
+        targets.append((d, ['generic', d.split(':')[0].split('+')[0]]))
+    print("{:>12} {:>12} {:>10} {:>12}".format('database', 'writer', 'seconds', 'rows/sec'))
+    for dbstring, names in targets:
+        for name in [None] + [n for n in names if n in WRITERS]:
+            seconds = measure(dbstring, name, df)
+            print("{:>12} {:>12} {:>10.2f} {:>12.0f}".format(
+                dbstring.split(':')[0], name or 'to_dict', seconds, len(df) / seconds))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,117 @@
+"""
+    Check: downloads interrupted in various ways end up byte-identical to the served files
+    files are generated with synthetic.py and served by a local stand-in (serve.py):
+    truncated responses are resumed with range requests and responses shorter than the
+    advertised size are caught by the size check, a stale part file larger than the file
+    gets 416 and is downloaded again, a part file left by an interrupted run is resumed
+    python benchmarks/check_download.py [n_weeks] [n_devices]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import re
+import sys
+import shutil
+import logging
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pymtattl import Downloader
+from synthetic import writeFiles
+from serve import serveDirectory, TurnstileHandler
+
+
+class FlakyHandler(TurnstileHandler):
+    """cut the first two responses of every data file short:
+        the first sends half of its body and closes the connection,
+        the second, resuming it, sends half of the requested range as a complete 206 response
+    """
+    served = {} # data file name -> responses so far
+    lock = threading.Lock()
+
+    def _send(self, status, body, headers=()):
+        name = self.path.split('/')[-1]
+        if not name.startswith('turnstile_') or status not in (200, 206):
+            return TurnstileHandler._send(self, status, body, headers)
+        with self.lock:
+            n = self.served[name] = self.served.get(name, 0) + 1
+        if n == 1:
+            self.send_response(status)
+            for k, v in headers:
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        if n == 2 and status == 206:
+            start, total = re.match(r'bytes (\d+)-\d+/(\d+)', dict(headers)['Content-Range']).groups()
+            body = body[:len(body) // 2]
+            headers = [('Content-Range', 'bytes {}-{}/{}'.format(start, int(start) + len(body) - 1, total))]
+        TurnstileHandler._send(self, status, body, headers)
+
+
+def download(source, directory, handler=TurnstileHandler):
+    """fetch all files of source into directory/download, return {file_date: attempts}"""
+    records = []
+    server, url = serveDirectory(source, handler=handler)
+    try:
+        Downloader(directory=directory, url=url, metrics=records.append).run(
+            date_range=('2000-01-01', '2099-12-31'), concurrency=2, retries=3)
+    finally:
+        server.shutdown()
+    return {r['file_date']: r['attempts'] for r in records if r['stage'] == 'fetch'}
+
+
+def compare(paths, directory):
+    """assert every source file was downloaded byte for byte and no part file is left"""
+    output = os.path.join(directory, 'download')
+    for p in paths:
+        with open(p, 'rb') as f, open(os.path.join(output, os.path.basename(p)), 'rb') as g:
+            assert f.read() == g.read(), "{} differs from its source".format(os.path.basename(p))
+    left = [n for n in os.listdir(output) if n.endswith('.part')]
+    assert not left, "part files left: {}".format(left)
+
+
+def main(n_weeks=3, n_devices=200):
+    logging.disable(logging.WARNING)
+    root = tempfile.mkdtemp()
+    source = os.path.join(root, 'source')
+    paths = writeFiles(source, '2014-10-04', int(n_weeks), int(n_devices))
+    try:
+        # truncated body, then a short range caught by the size check, then the rest
+        directory = os.path.join(root, 'truncated')
+        attempts = download(source, directory, FlakyHandler)
+        compare(paths, directory)
+        assert set(attempts.values()) == {3}, attempts
+        print("truncated responses: {} files identical, attempts {}".format(len(paths), attempts))
+
+        # stale part file larger than the file: 416, removed, downloaded again
+        directory = os.path.join(root, 'stale')
+        os.makedirs(os.path.join(directory, 'download'))
+        for p in paths:
+            with open(p, 'rb') as f, open(os.path.join(directory, 'download', os.path.basename(p) + '.part'), 'wb') as g:
+                g.write(f.read() + b'stale bytes\n')
+        attempts = download(source, directory)
+        compare(paths, directory)
+        assert set(attempts.values()) == {2}, attempts
+        print("stale part files: {} files identical, attempts {}".format(len(paths), attempts))
+
+        # part file left by an interrupted run: resumed from its size
+        directory = os.path.join(root, 'resumed')
+        os.makedirs(os.path.join(directory, 'download'))
+        for p in paths:
+            with open(p, 'rb') as f, open(os.path.join(directory, 'download', os.path.basename(p) + '.part'), 'wb') as g:
+                data = f.read()
+                g.write(data[:len(data) // 3])
+        attempts = download(source, directory)
+        compare(paths, directory)
+        assert set(attempts.values()) == {1}, attempts
+        print("interrupted part files: {} files identical, attempts {}".format(len(paths), attempts))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
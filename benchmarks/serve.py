@@ -0,0 +1,71 @@
+"""
+    Local stand-in for the MTA turnstile page, serves data files of a directory to Downloader
+    turnstile.html links every turnstile_yymmdd.txt as data/nyct/turnstile/<name>,
+    range requests are honoured so resumed downloads work
+    python benchmarks/serve.py directory [port]
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import re
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class TurnstileHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, as the mta site
+    directory = '.'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=()):
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        name = self.path.split('?')[0].split('/')[-1]
+        if name == 'turnstile.html':
+            names = sorted(n for n in os.listdir(self.directory) if n.startswith('turnstile_'))
+            body = ''.join('<a href="data/nyct/turnstile/{0}">{0}</a><br/>\n'.format(n) for n in names)
+            return self._send(200, body.encode(), [('Content-Type', 'text/html')])
+        path = os.path.join(self.directory, name)
+        if not name.startswith('turnstile_') or not os.path.isfile(path):
+            return self._send(404, b'')
+        with open(path, 'rb') as f:
+            data = f.read()
+        m = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if m is None:
+            return self._send(200, data)
+        start = int(m.group(1))
+        if start >= len(data):
+            return self._send(416, b'', [('Content-Range', 'bytes */{}'.format(len(data)))])
+        self._send(206, data[start:], [('Content-Range', 'bytes {}-{}/{}'.format(start, len(data) - 1, len(data)))])
+
+
+def serveDirectory(directory, port=0, handler=TurnstileHandler):
+    """serve directory in a background thread, return (server, url) to pass to Downloader(url=...)
+        handler: TurnstileHandler or a subclass of it
+        call server.shutdown() when done
+    """
+    handler = type(str('Handler'), (handler,), {'directory': os.path.abspath(directory)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+
+if __name__ == '__main__':
+    server, url = serveDirectory(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 8000)
+    print("Serving {} at {}".format(sys.argv[1], url))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
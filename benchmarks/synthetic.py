@@ -0,0 +1,105 @@
+"""
+    Synthetic MTA turnstile data files for benchmarks
+    readings every 4 hours, pre 141018 files in the wide layout (8 readings per line, no header),
+    later files in the narrow layout with header; counters continue from week to week
+    python benchmarks/synthetic.py directory start_date(yyyy-mm-dd) n_weeks n_devices
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import sys
+import random
+from datetime import datetime, timedelta
+
+HEADER = "C/A,UNIT,SCP,STATION,LINENAME,DIVISION,DATE,TIME,DESC,ENTRIES,EXITS\n"
+NARROW_FROM = 141018 # first file in the narrow layout
+DEVICES_PER_STATION = 8
+# device anomalies, see Data Issues in README: one kind per affected device
+DEVICE_ANOMALIES = ('backwards', 'jumps', 'reset', 'recover')
+# line anomalies: unparseable date, empty exit count, wrong number of columns
+LINE_ANOMALIES = ('bad_date', 'empty', 'broken')
+ANOMALIES = DEVICE_ANOMALIES + LINE_ANOMALIES
+
+
+def deviceKey(d):
+    """ca, unit, scp of the d-th device"""
+    s = d // DEVICES_PER_STATION
+    return 'A{:03d}'.format(s), 'R{:03d}'.format(s), '02-00-{:02d}'.format(d % DEVICES_PER_STATION)
+
+
+def makeLines(datevalue, n_devices, n_days=7, seed=0, anomalies=ANOMALIES, rate=0.02, state=None):
+    """synthetic weekly file content in the layout used at datevalue, as list of lines
+        anomalies: kinds of ANOMALIES to inject, empty for clean data
+        rate: share of devices with a device anomaly, line anomalies are added once per 1/rate devices
+        state: {device: [entry, exit]} counters, continued and updated across calls
+    """
+    rnd = random.Random('{}:{}'.format(seed, datevalue))
+    state = {} if state is None else state
+    narrow = datevalue >= NARROW_FROM
+    start = datetime.strptime(str(datevalue), '%y%m%d') - timedelta(days=n_days)
+    stamps = [start + timedelta(hours=4 * k) for k in range(6 * n_days)]
+    dates = [t.strftime('%m/%d/%Y' if narrow else '%m-%d-%y') for t in stamps]
+    times = [t.strftime('%H:%M:%S') for t in stamps]
+    device_kinds = [a for a in DEVICE_ANOMALIES if a in anomalies]
+    every = max(int(round(1 / rate)), 1) if rate else 0
+    lines = [HEADER] if narrow else []
+    for d in range(n_devices):
+        ca, unit, scp = deviceKey(d)
+        entry, exit = state.get(d) or [rnd.randint(0, 10 ** 7), rnd.randint(0, 10 ** 7)]
+        kind = device_kinds[(d // every) % len(device_kinds)] if device_kinds and every and d % every == every - 1 else None
+        step = -1 if kind == 'backwards' else 1
+        readings = []
+        for k in range(len(stamps)):
+            entry = max(entry + step * rnd.randint(0, 500), 0)
+            exit = max(exit + step * rnd.randint(0, 400), 0)
+            if kind == 'reset' and k == len(stamps) // 2:
+                entry, exit = rnd.randint(0, 100), rnd.randint(0, 100)
+            e, x, desc = entry, exit, 'REGULAR'
+            if kind == 'jumps' and k % 2:
+                e, x = e + 80000, x + 8000 # every second record off
+            if kind == 'recover' and k % 2:
+                desc = 'RECOVR AUD'
+            readings.append([dates[k], times[k], desc, '{:010d}'.format(e), '{:010d}'.format(x)])
+        state[d] = [entry, exit]
+        if narrow:
+            for r in readings:
+                lines.append(','.join([ca, unit, scp, '59 ST', 'NQR456W', 'BMT'] + r) + '\n')
+        else:
+            for k in range(0, len(readings), 8):
+                lines.append(','.join([ca, unit, scp] + sum(readings[k:k+8], [])) + '\n')
+    # line anomalies at random places after the header
+    first = 1 if narrow else 0
+    prefix = ['A999', 'R999', '00-00-00'] + (['59 ST', 'NQR456W', 'BMT'] if narrow else [])
+    n_bad = max(n_devices // every, 1) if every else 0
+    for kind in [a for a in LINE_ANOMALIES if a in anomalies] * n_bad:
+        if kind == 'bad_date':
+            line = ','.join(prefix + ['13/45/2017', '00:00:00', 'REGULAR', '0000000001', '0000000001'])
+        elif kind == 'empty':
+            line = ','.join(prefix + [dates[0], times[0], 'REGULAR', '0000000001', ''])
+        else:
+            line = ','.join(prefix[:3] + ['broken'])
+        lines.insert(rnd.randint(first, len(lines)), line + '\n')
+    return lines
+
+
+def writeFiles(directory, start_date, n_weeks, n_devices, seed=0, anomalies=ANOMALIES, rate=0.02):
+    """write n_weeks weekly turnstile_yymmdd.txt files, the first one dated start_date (yyyy-mm-dd),
+        return list of file paths
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    day = datetime.strptime(start_date, '%Y-%m-%d')
+    state, paths = {}, []
+    for _ in range(n_weeks):
+        datevalue = int(day.strftime('%y%m%d'))
+        path = os.path.join(directory, 'turnstile_{}.txt'.format(datevalue))
+        with open(path, 'w') as f:
+            f.writelines(makeLines(datevalue, n_devices, seed=seed, anomalies=anomalies, rate=rate, state=state))
+        paths.append(path)
+        day += timedelta(days=7)
+    return paths
+
+
+if __name__ == '__main__':
+    paths = writeFiles(sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    print("\n".join(paths))
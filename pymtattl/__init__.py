@@ -1,3 +1,4 @@
 from .download import Downloader
 from .clean import Cleaner
-from .utils import station_mapping
\ No newline at end of file
+from .utils import station_mapping, station_series
+from .ingest import ingest
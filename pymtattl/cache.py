@@ -0,0 +1,117 @@
+"""
+    Content-addressed cache of processed data files
+    each entry is a directory of .npy column files, named by the sha256 of
+    parser version + file date + sha256 of file content, numeric columns are memory-mapped on load
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from .utils import createPath, fileChecksum
+
+KEYS = ['ca', 'unit', 'scp']
+
+
+class ParseCache:
+    """size-bounded LRU cache of Cleaner._process output
+        directory: where entries are stored(str)
+        max_mb: total size kept, least recently used entries are evicted beyond it
+    """
+    def __init__(self, directory, max_mb=1024, version=1):
+        self.directory = createPath(directory)
+        self.max_bytes = int(max_mb * 2**20)
+        self.version = version
+
+    def key(self, path, datevalue, checksum=None):
+        """hash of parser version, file date and checksum of (decompressed) file content
+            checksum: utils.fileChecksum of the file if already known, otherwise it is computed
+        """
+        checksum = checksum or fileChecksum(path)
+        return hashlib.sha256('{}:{}:{}'.format(self.version, datevalue, checksum).encode()).hexdigest()
+
+    def load(self, key, stats=None):
+        """return cached dataframe or None
+            stats: dict to receive the reading counts stored with the entry
+        """
+        entry = os.path.join(self.directory, key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            col = lambda name, mmap=None: np.load(os.path.join(entry, name + '.npy'), mmap_mode=mmap)
+            index = pd.MultiIndex(levels=[col(k + '_levels') for k in KEYS],
+                                  codes=[col(k, 'r') for k in KEYS], names=KEYS)
+            description = pd.Categorical.from_codes(col('description', 'r'), col('description_levels').astype(object))
+            df = pd.DataFrame({
+                'timestamp': col('timestamp', 'r'),
+                'description': description,
+                'entry': col('entry', 'r'),
+                'exit': col('exit', 'r'),
+            }, index=index)
+        except (OSError, ValueError):
+            # evicted or half written by another process
+            return None
+        if stats is not None and os.path.exists(os.path.join(entry, 'stats.json')):
+            with open(os.path.join(entry, 'stats.json')) as f:
+                stats.update(json.load(f))
+        os.utime(entry) # mark as recently used
+        return df
+
+    def store(self, key, df, stats=None):
+        """write processed dataframe (indexed by ca, unit, scp) as a cache entry
+            stats: reading counts of the parse, returned by load
+        """
+        entry = os.path.join(self.directory, key)
+        if os.path.isdir(entry):
+            return
+        tmp = createPath('{}.tmp{}'.format(entry, os.getpid()))
+        for k, level, codes in zip(KEYS, df.index.levels, df.index.codes):
+            np.save(os.path.join(tmp, k + '_levels.npy'), np.asarray(level, dtype=str))
+            np.save(os.path.join(tmp, k + '.npy'), np.asarray(codes))
+        description = pd.Categorical(df['description'])
+        np.save(os.path.join(tmp, 'description_levels.npy'), np.asarray(description.categories, dtype=str))
+        np.save(os.path.join(tmp, 'description.npy'), description.codes)
+        for c in ['timestamp', 'entry', 'exit']:
+            np.save(os.path.join(tmp, c + '.npy'), df[c].values)
+        if stats is not None:
+            with open(os.path.join(tmp, 'stats.json'), 'w') as f:
+                json.dump(stats, f)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # stored by another process in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def _entries(self):
+        """(last used, size, path) of complete entries"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if '.tmp' in name or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        return sorted(entries)
+
+    def evict(self):
+        """remove least recently used entries until the cache fits in max_mb"""
+        entries = self._entries()
+        total = sum(e[1] for e in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def invalidate(self, key=None):
+        """remove one entry, or the whole cache if key is None"""
+        paths = [os.path.join(self.directory, key)] if key else [e[2] for e in self._entries()]
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,103 @@
+"""
+    Columnar (parquet) store for decumulated turnstile data, requires pyarrow
+    layout under path:
+        turnstile/file_date=yymmdd/part-nnnn.parquet    decumulated readings
+        station.parquet, device.parquet, previous.parquet    snapshot of db state tables
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import os
+import re
+import shutil
+import pandas as pd
+from sqlalchemy import select
+from .sqlalchemy_declarative import Station, Device, Previous
+from .utils import createPath, str2intDate
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+COLUMNS = ['device_id', 'timestamp', 'description', 'entry', 'exit']
+PART_REGEX = re.compile(r'part-(\d+)\.parquet$')
+
+
+def requireArrow():
+    if pa is None:
+        raise ImportError("Parquet output requires pyarrow: pip install pyarrow")
+
+
+class ParquetSink:
+    """write decumulated batches as parquet, partitioned by file_date
+        a week written for the first time by this sink replaces any earlier output of that week,
+        unless it is resumed: parts written by earlier runs are kept and numbering continues after them
+    """
+    def __init__(self, path):
+        requireArrow()
+        self.path = createPath(path)
+        self._parts = {} # file_date -> part files written by this sink
+        self.schema = pa.schema([('device_id', pa.int32()), ('timestamp', pa.int64()),
+                                 ('description', pa.dictionary(pa.int32(), pa.string())),
+                                 ('entry', pa.int32()), ('exit', pa.int32())])
+
+    def write(self, df, resumed=()):
+        """write dataframe with COLUMNS and file_date, one part file per file_date
+            resumed: file dates partly loaded by an earlier run, their parts are kept
+            return paths of the part files written
+        """
+        paths = []
+        for file_date, part in df.groupby('file_date', sort=True):
+            directory = os.path.join(self.path, 'turnstile', 'file_date={}'.format(file_date))
+            if file_date not in self._parts:
+                if file_date in resumed and os.path.isdir(directory):
+                    numbers = [int(m.group(1)) for m in map(PART_REGEX.match, os.listdir(directory)) if m]
+                    self._parts[file_date] = max(numbers) + 1 if numbers else 0
+                else:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    os.makedirs(directory)
+                    self._parts[file_date] = 0
+            table = pa.Table.from_pandas(part[COLUMNS], schema=self.schema, preserve_index=False)
+            paths.append(os.path.join(directory, 'part-{:04d}.parquet'.format(self._parts[file_date])))
+            pq.write_table(table, paths[-1])
+            self._parts[file_date] += 1
+        return paths
+
+    def write_state(self, conn):
+        """snapshot station, device and previous tables next to the readings"""
+        for model in (Station, Device, Previous):
+            table = model.__table__
+            columns = [c.name for c in table.columns]
+            df = pd.DataFrame.from_records(conn.execute(select([table])).fetchall(), columns=columns)
+            if model is Station:
+                df = df.astype({'latitude': 'float64', 'longitude': 'float64'})
+            path = os.path.join(self.path, table.name + '.parquet')
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+
+def read_turnstile(path, date_range=None, devices=None, columns=None):
+    """read decumulated readings from a parquet store
+        date_range: (start_date(str), end_date(str)), yyyy-mm-dd, matched on file_date,
+            only partitions within the range are opened
+        devices: device ids, pushed down to parquet row group statistics
+        columns: subset of device_id, timestamp, description, entry, exit, file_date
+    """
+    requireArrow()
+    dataset = ds.dataset(os.path.join(path, 'turnstile'), format='parquet', partitioning='hive')
+    expr = None
+    if date_range is not None:
+        expr = ((ds.field('file_date') >= str2intDate(date_range[0])) &
+                (ds.field('file_date') <= str2intDate(date_range[1])))
+    if devices is not None:
+        cond = ds.field('device_id').isin([int(d) for d in devices])
+        expr = cond if expr is None else expr & cond
+    return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+
+def read_state(path, name):
+    """read snapshot of 'station', 'device' or 'previous' table from a parquet store"""
+    requireArrow()
+    return pq.read_table(os.path.join(path, name + '.parquet')).to_pandas()
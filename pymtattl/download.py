@@ -8,12 +8,22 @@ from __future__ import absolute_import, print_function, unicode_literals
 import os
 import sys
 import re
+import time
+import threading
+import http.client
 from urllib.request import urlopen
+from urllib.parse import urlsplit, urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from bs4 import BeautifulSoup
-from .utils import createLogger, createPath, str2intDate, parseDate, filterUrl
+from .utils import (createLogger, createPath, str2intDate, parseDate, filterUrl, compressFile, requireZstd,
+                    COMPRESSIONS)
+from .metrics import Metrics
 
 URL = "http://web.mta.info/developers/"
+CHUNK_SIZE = 1 << 16 # bytes read from the response per write
+BACKOFF = 1.0 # seconds before the first retry, doubled on every further retry
+MAX_REDIRECTS = 5
 
 class Downloader:
     """
@@ -21,11 +31,26 @@ class Downloader:
         Take in job requirements:
             date range: (start_date(str), end_date(str)),
             main_path (required, store data files): directory(str),
+            url: mta developers page hosting turnstile.html(str),
+            metrics: JSON lines file or function(record) receiving per-file stage metrics,
+                default None (<directory>/log/<time>.metrics.jsonl),
+            profile, trace: stage run under cProfile (stats in <directory>/log/<time>.prof) or tracemalloc,
+            compression: store data files compressed, 'gzip', 'xz' or 'zstd' (requires zstandard),
+                default None (plain text),
             verbose
     """
 
-    def __init__(self, directory='./data/', local=True):
+    def __init__(self, directory='./data/', local=True, url=URL, metrics=None, profile=None, trace=None,
+                 compression=None):
         JOB = 'download'
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression {}, use one of {}".format(compression, sorted(COMPRESSIONS)))
+        if compression == 'zstd':
+            requireZstd()
+        self.url = url
+        self.compression = compression
+        self._local = threading.local() # keep-alive connections, one set per thread
+        self._opened = [] # every connection opened, closed when downloading is done
 
         now = datetime.now().strftime("%Y%m%d%H%M%S")
         self.directory = createPath(directory)
@@ -33,6 +58,8 @@ class Downloader:
         log_dir = createPath(os.path.join(directory, 'log'))
         self._log_path = os.path.join(log_dir, now+".log")
         self.logger = createLogger(JOB, self._log_path)
+        self.metrics = Metrics(JOB, metrics or os.path.join(log_dir, now + ".metrics.jsonl"),
+                               profile, trace, os.path.join(log_dir, now + ".prof"))
 
     def _create(self, date_range):
         """before execution, check parameters are all in place"""
@@ -43,8 +70,8 @@ class Downloader:
 
     def _retreive(self, date_range):
         """get all txt file urls from mta site"""
-        data_regex = re.compile(r'turnstile_\d{6}.txt$')
-        soup = BeautifulSoup(urlopen(URL + "turnstile.html"), "lxml")
+        data_regex = re.compile(r'turnstile_\d{6}\.txt$')
+        soup = BeautifulSoup(urlopen(self.url + "turnstile.html"), "lxml")
         urls = [u['href'] for u in soup.find_all('a', href=data_regex)]
         self.logger.info('{} data file urls found on mta site.'.format(len(urls)))
         filter_urls = filterUrl(urls, date_range)
@@ -54,30 +81,170 @@ class Downloader:
         self.logger.info('{} available data files within time window.'.format(len(filter_urls)))
         return filter_urls
 
-    def _download(self, urls, verbose):
+    def _connection(self, scheme, netloc):
+        """return this thread's open connection to host, reused across files"""
+        conns = self._local.__dict__.setdefault('conns', {})
+        if (scheme, netloc) not in conns:
+            cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conns[(scheme, netloc)] = cls(netloc, timeout=60)
+            self._opened.append(conns[(scheme, netloc)])
+        return conns[(scheme, netloc)]
+
+    def _disconnect(self):
+        """drop this thread's connections after an error, next request reconnects"""
+        for conn in self._local.__dict__.pop('conns', {}).values():
+            conn.close()
+
+    def _stream(self, url, part):
+        """stream url into part file, resume from its current size if it exists
+            raise IOError unless the part file ends up with the advertised size
+        """
+        for _ in range(MAX_REDIRECTS):
+            parts = urlsplit(url)
+            conn = self._connection(parts.scheme, parts.netloc)
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+            conn.request('GET', parts.path + ('?' + parts.query if parts.query else ''), headers=headers)
+            resp = conn.getresponse()
+            if resp.status in (301, 302, 303, 307, 308) and resp.getheader('Location'):
+                resp.read()
+                url = urljoin(url, resp.getheader('Location'))
+                continue
+            if resp.status == 206:
+                # Content-Range: bytes start-end/total
+                start, total = re.match(r'bytes (\d+)-\d+/(\d+|\*)', resp.getheader('Content-Range', '')).groups()
+                if int(start) != offset:
+                    resp.read()
+                    raise IOError("Unexpected range {} for {}".format(resp.getheader('Content-Range'), url))
+                mode, total = 'ab', int(total) if total != '*' else None
+            elif resp.status == 416:
+                # nothing left to fetch or stale part file, start over
+                resp.read()
+                os.remove(part)
+                raise IOError("Range not satisfiable for {}, restart download".format(url))
+            elif resp.status == 200:
+                length = resp.getheader('Content-Length')
+                mode, total = 'wb', int(length) if length is not None else None
+            else:
+                resp.read()
+                raise IOError("HTTP {} {} for {}".format(resp.status, resp.reason, url))
+            with open(part, mode) as f:
+                while True:
+                    chunk = resp.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            size = os.path.getsize(part)
+            if total is not None and size != total:
+                raise IOError("Incomplete download of {}: {} out of {} bytes".format(url, size, total))
+            return size
+        raise IOError("Too many redirects for {}".format(url))
+
+    def _existing(self, u):
+        """path of the downloaded data file of url, plain or compressed, None if not downloaded"""
+        p = os.path.join(self._output_path, u.split('/')[-1])
+        for path in [p] + [p + suffix for suffix in COMPRESSIONS.values()]:
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _fetch(self, u, retries):
+        """download one data file, return its path or None if it already exists
+            data is streamed into <file>.part and renamed once complete,
+            failed attempts are retried with exponential backoff and resume the part file,
+            with compression the complete file is then compressed
+        """
+        p = self._existing(u)
+        if p is not None:
+            self.logger.info("File exists: {}".format(p))
+            return None
+        p = os.path.join(self._output_path, u.split('/')[-1])
+        part = p + '.part'
+        with self.metrics.stage('fetch', file_date=parseDate(u)) as record:
+            for attempt in range(retries + 1):
+                record['attempts'] = attempt + 1
+                try:
+                    record['bytes'] = self._stream(urljoin(self.url, u), part)
+                    os.replace(part, p)
+                    if self.compression:
+                        p = compressFile(p, self.compression)
+                        record['stored_bytes'] = os.path.getsize(p)
+                    return p
+                except (IOError, http.client.HTTPException) as e:
+                    self._disconnect()
+                    if attempt == retries:
+                        raise
+                    wait = BACKOFF * 2 ** attempt
+                    self.logger.warning("Retry {0} in {1}s: {2}".format(u, wait, e))
+                    time.sleep(wait)
+
+    def _download(self, urls, verbose, concurrency=4, retries=3):
         """download data from mta web"""
         self.logger.info("Start downloading process.")
         paths = []
-        for i, u in enumerate(urls):
-            p = os.path.join(self._output_path, u.split('/')[-1])
-            if not os.path.exists(p):
-                data = urlopen(URL + u).read()
-                with open(p, 'wb+') as f:
-                    f.write(data)
-                paths.append(p)
-            else:
-                self.logger.info("File exists: {}".format(p))
-            if (i > 0) and (i % verbose == 0):
-                self.logger.info("Processed {} files...".format(i))
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(self._fetch, u, retries): u for u in urls}
+            for i, future in enumerate(as_completed(futures)):
+                try:
+                    p = future.result()
+                    if p:
+                        paths.append(p)
+                except Exception as e:
+                    self.logger.error("Failed to download {0}: {1}".format(futures[future], e))
+                if (i > 0) and (i % verbose == 0):
+                    self.logger.info("Processed {} files...".format(i))
+        for conn in self._opened:
+            conn.close()
+        self._opened = []
+        paths.sort()
         self.logger.info("Complete: downloaded {0} out of {1} files.".format(len(paths), len(urls)))
         return paths
 
-    def run(self, date_range=("2018-01-01", "2018-02-01"), verbose=10):
-        """execution phase based on parameters"""
+    def stream(self, date_range=("2018-01-01", "2018-02-01"), concurrency=4, retries=3, skip=()):
+        """download data files in the background, yield each file name in file date order
+            as soon as it and all earlier files are on disk, files already downloaded are yielded too;
+            stops at the first file that fails to download
+            skip: file dates (yymmdd) not to download, e.g. files already loaded
+        """
+        date_range = self._create(date_range)
+        with self.metrics.stage('retrieve') as record:
+            skip = set(skip)
+            urls = sorted((u for u in self._retreive(date_range) if parseDate(u) not in skip), key=parseDate)
+            record['files'] = len(urls)
+        pool = ThreadPoolExecutor(max_workers=concurrency)
+        futures = [(u, pool.submit(self._fetch, u, retries)) for u in urls]
+        try:
+            for u, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.error("Failed to download {0}, later files are not passed on: {1}".format(u, e))
+                    return
+                yield os.path.basename(self._existing(u))
+        finally:
+            for _, future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+            for conn in self._opened:
+                conn.close()
+            self._opened = []
+            self.metrics.close()
+
+    def run(self, date_range=("2018-01-01", "2018-02-01"), verbose=10, concurrency=4, retries=3):
+        """execution phase based on parameters
+            concurrency: number of files downloaded at the same time
+            retries: attempts per file after the first failure
+        """
         try:
             date_range = self._create(date_range)
-            urls = self._retreive(date_range)
-            paths = self._download(urls, verbose)
+            with self.metrics.stage('retrieve') as record:
+                urls = self._retreive(date_range)
+                record['files'] = len(urls)
+            with self.metrics.stage('download', files=len(urls)) as record:
+                paths = self._download(urls, verbose, concurrency, retries)
+                record['bytes'] = sum(os.path.getsize(p) for p in paths)
             return paths
         except Exception as e:
-            self.logger.error(e, exc_info=True)
\ No newline at end of file
+            self.logger.error(e, exc_info=True)
+        finally:
+            self.metrics.close()
\ No newline at end of file
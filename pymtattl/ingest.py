@@ -0,0 +1,68 @@
+"""
+    Download and load in one pass: each data file is parsed, decumulated and written
+    as soon as it and all earlier files are downloaded, while later files are still downloading
+    command line: pymtattl-ingest 2019-01-01 2019-02-01 --dbstring sqlite:///mta_sample.db
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import argparse
+from .download import Downloader, URL
+from .clean import Cleaner
+from .sqlalchemy_declarative import read_manifest
+
+
+def ingest(date_range=("2018-01-01", "2018-02-01"), directory='./data/', dbstring='sqlite:///mta_sample.db',
+           keep_raw=True, concurrency=4, retries=3, url=URL, batch_mb=None, workers=None, chunk_mb=None,
+           thresholds=None, compression=None, **options):
+    """download data files within date range and load them into the database
+        files loaded by earlier runs (ingest table) are not downloaded again
+        keep_raw: keep data files under <directory>/download once loaded, default True
+        concurrency, retries, url, compression: as in Downloader
+        batch_mb, workers, chunk_mb, thresholds: as in Cleaner.run
+        options: other Cleaner arguments (writer, parquet_path, sql, cache_mb, rollup, metrics, ...)
+    """
+    clean = Cleaner(directory=directory, dbstring=dbstring, **options)
+    engine, _ = clean._configDB()
+    with engine.connect() as conn:
+        loaded = [d for d, m in read_manifest(conn).items() if m['status'] == 'complete']
+    engine.dispose()
+    download = Downloader(directory=directory, url=url, metrics=options.get('metrics'), compression=compression)
+    files = download.stream(date_range, concurrency, retries, skip=loaded)
+    try:
+        clean.load(files, batch_mb, workers, chunk_mb, thresholds, keep_raw)
+    finally:
+        files.close() # stop downloads left after a failed batch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pymtattl-ingest',
+                                     description='Download MTA turnstile data files and load them into a database.')
+    parser.add_argument('start_date', help='yyyy-mm-dd')
+    parser.add_argument('end_date', help='yyyy-mm-dd')
+    parser.add_argument('--directory', default='./data/', help='data, log and cache directory (default ./data/)')
+    parser.add_argument('--dbstring', default='sqlite:///mta_sample.db', help='sqlalchemy database url')
+    parser.add_argument('--no-keep-raw', dest='keep_raw', action='store_false',
+                        help='remove data files once they are loaded')
+    parser.add_argument('--concurrency', type=int, default=4, help='files downloaded at the same time')
+    parser.add_argument('--retries', type=int, default=3, help='attempts per file after the first failure')
+    parser.add_argument('--url', default=URL, help='page hosting turnstile.html')
+    parser.add_argument('--compression', choices=['gzip', 'xz', 'zstd'], help='store data files compressed')
+    parser.add_argument('--batch-mb', type=float, help='decumulate and write files together up to this size')
+    parser.add_argument('--workers', type=int, help='processes parsing files in parallel')
+    parser.add_argument('--chunk-mb', type=float, help='stream files in pieces of this size')
+    parser.add_argument('--writer', help="turnstile writer: 'generic', 'sqlite' or 'postgresql'")
+    parser.add_argument('--parquet-path', help='also write parquet output under this directory')
+    parser.add_argument('--no-sql', dest='sql', action='store_false', help='keep turnstile data in parquet only')
+    parser.add_argument('--cache-mb', type=float, help='parse cache size')
+    parser.add_argument('--no-rollup', dest='rollup', action='store_false', help='do not maintain station rollups')
+    parser.add_argument('--metrics', help='JSON lines file for stage metrics')
+    args = parser.parse_args(argv)
+    ingest((args.start_date, args.end_date), args.directory, args.dbstring, args.keep_raw,
+           args.concurrency, args.retries, args.url, args.batch_mb, args.workers, args.chunk_mb,
+           compression=args.compression,
+           writer=args.writer, parquet_path=args.parquet_path, sql=args.sql, cache_mb=args.cache_mb,
+           rollup=args.rollup, metrics=args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+    Per-stage metrics of Downloader and Cleaner runs
+    one record (dict) per stage of a file or batch: job, stage, seconds, rows/bytes counts,
+    rows_per_sec, peak_rss_mb, written as JSON lines and/or passed to a callback
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import sys
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+
+def peakRSS():
+    """peak resident set size of this process in MB, None where unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def timed(func, *args):
+    """return (func(*args), seconds), picklable for process pools"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class Metrics:
+    """collect stage records of one run
+        job: 'download' or 'clean'
+        output: JSON lines file path or function(record), default None (records are dropped)
+        profile: stage run under cProfile, stats of all its runs dumped to profile_path
+        trace: stage run under tracemalloc, peak traced memory and top allocations added to its records
+        profile and trace only apply to stages run in the main thread of this process
+    """
+    def __init__(self, job, output=None, profile=None, trace=None, profile_path=None):
+        self.job = job
+        self.path = output if isinstance(output, str) else None
+        self.callback = output if callable(output) else None
+        self.profile = profile
+        self.trace = trace
+        self.profile_path = profile_path
+        self._profiler = cProfile.Profile() if profile else None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """time a stage, yield its record to be filled with counts (rows_in, rows_out, bytes, ...)
+            the record is emitted when the stage is done, also if it failed
+        """
+        record = dict(fields)
+        main = threading.current_thread() is threading.main_thread()
+        tracing = main and name == self.trace and not tracemalloc.is_tracing()
+        profiling = main and name == self.profile and self._profiler is not None
+        if tracing:
+            tracemalloc.start()
+        if profiling:
+            self._profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = str(e)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            if profiling:
+                self._profiler.disable()
+            if tracing:
+                snapshot = tracemalloc.take_snapshot()
+                record['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+                record['traced_top'] = [str(s) for s in snapshot.statistics('lineno')[:10]]
+                tracemalloc.stop()
+            self.emit(name, seconds, record)
+
+    def emit(self, name, seconds, record):
+        """complete a stage record and write it out"""
+        rows = record.get('rows_out', record.get('rows_in'))
+        record = dict({'job': self.job, 'stage': name, 'time': datetime.now().isoformat(),
+                       'seconds': round(seconds, 6)}, **record)
+        if rows is not None:
+            record['rows_per_sec'] = round(rows / seconds, 1) if seconds else None
+        if 'bytes' in record:
+            record['bytes_per_sec'] = round(record['bytes'] / seconds, 1) if seconds else None
+        record['peak_rss_mb'] = peakRSS()
+        with self._lock:
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record, default=str) + '\n')
+            if self.callback:
+                self.callback(record)
+
+    def __getstate__(self):
+        # copies sent to worker processes do not emit, callbacks need not pickle
+        return dict(self.__dict__, _lock=None, _profiler=None, callback=None)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def close(self):
+        """dump profile stats of the profiled stage"""
+        if self._profiler is not None and self.profile_path:
+            self._profiler.dump_stats(self.profile_path)
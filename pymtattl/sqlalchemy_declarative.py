@@ -1,7 +1,9 @@
 import os
 import sys
+import numpy as np
 import pandas as pd
-from sqlalchemy import Column, ForeignKey, Integer, String, Numeric
+from sqlalchemy import Column, ForeignKey, Integer, String, Numeric, UniqueConstraint, Index
+from sqlalchemy import select, inspect, func, text, bindparam, MetaData, Table
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import create_engine
@@ -12,6 +14,7 @@ Base = declarative_base()
 
 class Station(Base):
     __tablename__ = 'station'
+    __table_args__ = (UniqueConstraint('ca', 'unit'),)
     id = Column(Integer, primary_key=True)
     ca = Column(String(250), nullable=False)
     unit = Column(String(250), nullable=False)
@@ -23,6 +26,7 @@ class Station(Base):
 
 class Device(Base):
     __tablename__ = 'device'
+    __table_args__ = (UniqueConstraint('station_id', 'scp'),)
     id = Column(Integer, primary_key=True)
     station_id = Column(Integer, ForeignKey('station.id'))
     scp = Column(String(250), nullable=False)
@@ -38,6 +42,7 @@ class Turnstile(Base):
 
 class Previous(Base):
     __tablename__ = 'previous'
+    __table_args__ = (Index('ix_previous_device_id', 'device_id', unique=True),)
     id = Column(Integer, primary_key=True)
     device_id = Column(Integer, ForeignKey('device.id'))
     timestamp = Column(Integer, nullable=False)
@@ -46,13 +51,136 @@ class Previous(Base):
     exit = Column(Integer, nullable=False)
     file_date = Column(Integer, nullable=False)
 
+class Ingest(Base):
+    __tablename__ = 'ingest'
+    id = Column(Integer, primary_key=True)
+    file_date = Column(Integer, nullable=False, unique=True)
+    checksum = Column(String(64), nullable=False)
+    rows_in = Column(Integer, nullable=False) # readings parsed from file
+    rows_out = Column(Integer, nullable=False) # decumulated readings written
+    status = Column(String(16), nullable=False) # complete, partial (streamed pieces committed) or failed
+    lines = Column(Integer, nullable=False, server_default='0') # lines of file committed by streamed pieces, partial files resume after them
+
+class StationHourly(Base):
+    __tablename__ = 'station_hourly'
+    __table_args__ = (Index('ix_station_hourly_key', 'station_id', 'timestamp', 'file_date', unique=True),)
+    id = Column(Integer, primary_key=True)
+    station_id = Column(Integer, ForeignKey('station.id'))
+    timestamp = Column(Integer, nullable=False) # start of hour
+    file_date = Column(Integer, nullable=False) # data file the readings came from
+    entry = Column(Integer, nullable=False)
+    exit = Column(Integer, nullable=False)
+
+class StationDaily(Base):
+    __tablename__ = 'station_daily'
+    __table_args__ = (Index('ix_station_daily_key', 'station_id', 'timestamp', 'file_date', unique=True),)
+    id = Column(Integer, primary_key=True)
+    station_id = Column(Integer, ForeignKey('station.id'))
+    timestamp = Column(Integer, nullable=False) # start of day
+    file_date = Column(Integer, nullable=False)
+    entry = Column(Integer, nullable=False)
+    exit = Column(Integer, nullable=False)
+
+ROLLUPS = {'hour': (StationHourly, 3600), 'day': (StationDaily, 86400)}
+
 def create_all_table(engine_string='sqlite:///test_data.db'):
     # Create all tables in the engine. Equivalent to "Creat Table" in raw SQL.
     engine = create_engine(engine_string)
     Base.metadata.create_all(engine)
+    # previous table written by older versions (to_sql replace) has a plain id column
+    # without primary key nor the unique device_id index the upsert relies on
+    if not inspect(engine).get_pk_constraint(Previous.__tablename__)['constrained_columns']:
+        rebuild_previous(engine)
+    # station and device tables of older versions have no unique keys, duplicates may exist
+    for model, keys in [(Station, ['ca', 'unit']), (Device, ['station_id', 'scp'])]:
+        if not has_unique(engine, model.__tablename__, keys):
+            merge_duplicates(engine, model, keys)
+    # ingest table of older versions has no lines column
+    if 'lines' not in [c['name'] for c in inspect(engine).get_columns(Ingest.__tablename__)]:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE ingest ADD COLUMN lines INTEGER DEFAULT '0' NOT NULL"))
     return engine
 
 
+def rebuild_previous(engine):
+    """recreate previous table with the declared schema, keep its rows
+        rows are copied into a new table which then replaces the old one
+    """
+    table = Previous.__table__
+    columns = [c.name for c in table.columns if c.name != 'id']
+    meta = MetaData()
+    Device.__table__.to_metadata(meta) # target of the device_id foreign key
+    new = table.to_metadata(meta, name=table.name + '_new')
+    with engine.begin() as conn:
+        old = Table(table.name, MetaData(), autoload_with=conn)
+        for index in old.indexes: # index names are shared with the new table
+            index.drop(conn)
+        new.create(conn)
+        conn.execute(new.insert().from_select(columns, select([old.c[c] for c in columns])))
+        old.drop(conn)
+        conn.execute(text('ALTER TABLE {} RENAME TO {}'.format(new.name, table.name)))
+
+def has_unique(engine, table_name, keys):
+    """whether a unique constraint or unique index covers exactly these columns"""
+    insp = inspect(engine)
+    uniques = [u['column_names'] for u in insp.get_unique_constraints(table_name)]
+    uniques += [i['column_names'] for i in insp.get_indexes(table_name) if i['unique']]
+    return any(sorted(u) == sorted(keys) for u in uniques)
+
+
+def merge_duplicates(engine, model, keys):
+    """merge station (ca, unit) or device (station_id, scp) rows sharing their keys into the
+        lowest id, move rows referring to the others to it, then add a unique index on the keys
+    """
+    table = model.__table__
+    with engine.begin() as conn:
+        first, remap = {}, {} # keys -> lowest id, duplicated id -> lowest id
+        for row in conn.execute(select([table.c.id] + [table.c[k] for k in keys]).order_by(table.c.id)):
+            key = tuple(row[1:])
+            if key in first:
+                remap[row[0]] = first[key]
+            else:
+                first[key] = row[0]
+        if remap:
+            pairs = [{'dup': d, 'keep': k} for d, k in remap.items()]
+            if model is Station:
+                device = Device.__table__
+                conn.execute(device.update().where(device.c.station_id == bindparam('dup'))
+                                   .values(station_id=bindparam('keep')), pairs)
+                for rollup, _ in ROLLUPS.values():
+                    # rows of merged stations in the same hour/day are added up
+                    _remap_rows(conn, rollup.__table__, 'station_id', remap,
+                                lambda df: df.groupby(['station_id', 'timestamp', 'file_date'])[['entry', 'exit']]
+                                             .sum().reset_index())
+            else:
+                turnstile = Turnstile.__table__
+                conn.execute(turnstile.update().where(turnstile.c.device_id == bindparam('dup'))
+                                      .values(device_id=bindparam('keep')), pairs)
+                # latest reading of merged devices is kept
+                _remap_rows(conn, Previous.__table__, 'device_id', remap,
+                            lambda df: df.sort_values(['file_date', 'timestamp'])
+                                         .drop_duplicates('device_id', keep='last'))
+            for ids in chunks(list(remap)):
+                conn.execute(table.delete().where(table.c.id.in_(ids)))
+        conn.execute(text('CREATE UNIQUE INDEX uq_{0}_{1} ON {0} ({2})'.format(
+                          table.name, '_'.join(keys), ', '.join(keys))))
+
+
+def _remap_rows(conn, table, column, remap, combine):
+    """point rows of table at the lowest id of their merged station/device,
+        rows sharing a key afterwards are combined by combine(dataframe) -> dataframe
+    """
+    ids = sorted(set(remap) | set(remap.values()))
+    rows = []
+    for part in chunks(ids):
+        rows.extend(conn.execute(select([table]).where(table.c[column].in_(part))).fetchall())
+        conn.execute(table.delete().where(table.c[column].in_(part)))
+    df = pd.DataFrame.from_records(rows, columns=[c.name for c in table.columns]).drop(['id'], axis=1)
+    if len(df):
+        df[column] = df[column].replace(remap)
+        conn.execute(table.insert(), combine(df).to_dict(orient='records'))
+
+
 def get_one_or_create(session,
                       model,
                       create_method='',
@@ -81,4 +209,199 @@ def data_frame(query, columns):
     """
     def make_row(x):
         return dict([(c, getattr(x, c)) for c in columns])
-    return pd.DataFrame([make_row(x) for x in query])
\ No newline at end of file
+    return pd.DataFrame([make_row(x) for x in query])
+
+
+def _upsert_insert(conn):
+    """dialect insert supporting ON CONFLICT, None if not available"""
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if conn.dialect.name == 'sqlite':
+        try:
+            from sqlalchemy.dialects.sqlite import insert  # sqlalchemy >= 1.4
+            return insert
+        except ImportError:
+            pass
+    return None
+
+
+def chunks(values, size=500):
+    """split list into pieces, keep IN (...) clauses below db parameter limits"""
+    for i in range(0, len(values), size):
+        yield values[i:i+size]
+
+
+def read_previous(conn, device_ids):
+    """return Previous rows of given device ids as dataframe, without their id"""
+    table = Previous.__table__
+    columns = [c.name for c in table.columns if c.name != 'id']
+    rows = []
+    for ids in chunks([int(i) for i in device_ids]):
+        query = select([table.c[c] for c in columns]).where(table.c.device_id.in_(ids))
+        rows.extend(conn.execute(query).fetchall())
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    return df.astype({c: 'int64' for c in columns if c != 'description'})
+
+def upsert_previous(conn, df):
+    """insert or update Previous rows keyed by device_id
+        uses ON CONFLICT on postgresql/sqlite, delete + insert elsewhere
+    """
+    table = Previous.__table__
+    records = df[[c.name for c in table.columns if c.name != 'id']].to_dict(orient='records')
+    if not records:
+        return
+    insert = _upsert_insert(conn)
+    if insert is not None:
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['device_id'],
+            set_={c: stmt.excluded[c] for c in records[0] if c != 'device_id'})
+        conn.execute(stmt, records)
+    else:
+        for ids in chunks([r['device_id'] for r in records]):
+            conn.execute(table.delete().where(table.c.device_id.in_(ids)))
+        conn.execute(table.insert(), records)
+
+
+class DimensionCache:
+    """in-memory lookup of (ca, unit, scp) -> device_id, loaded once per run
+        new stations/devices are bulk inserted, then the lookup is reloaded from db
+        so ids created by a concurrent ingest are picked up instead of duplicated
+    """
+    def __init__(self, engine, retries=3):
+        self.engine = engine
+        self.retries = retries
+        self.stations = {}  # (ca, unit) -> station.id
+        self.devices = {}   # (ca, unit, scp) -> device.id
+        self.device_stations = {} # device.id -> station.id
+        self.load()
+
+    def load(self):
+        """(re)load station and device tables, keep lowest id on duplicated keys"""
+        stations, devices, device_stations = {}, {}, {}
+        with self.engine.connect() as conn:
+            query = select([Station.id, Station.ca, Station.unit]).order_by(Station.id)
+            for sid, ca, unit in conn.execute(query):
+                stations.setdefault((ca, unit), sid)
+            query = (select([Device.id, Station.ca, Station.unit, Device.scp, Device.station_id])
+                     .select_from(Device.__table__.join(Station.__table__, Device.station_id == Station.id))
+                     .order_by(Device.id))
+            for did, ca, unit, scp, sid in conn.execute(query):
+                devices.setdefault((ca, unit, scp), did)
+                device_stations[did] = sid
+        self.stations, self.devices, self.device_stations = stations, devices, device_stations
+
+    def _insert(self, keys):
+        """insert missing stations, then missing devices, one statement each"""
+        stations = sorted(set(k[:2] for k in keys) - set(self.stations))
+        if stations:
+            with self.engine.begin() as conn:
+                conn.execute(Station.__table__.insert(), [{'ca': ca, 'unit': unit} for ca, unit in stations])
+            self.load()
+        devices = sorted(k for k in keys if k not in self.devices)
+        if devices:
+            with self.engine.begin() as conn:
+                conn.execute(Device.__table__.insert(),
+                             [{'station_id': self.stations[k[:2]], 'scp': k[2]} for k in devices])
+            self.load()
+
+    def resolve(self, keys):
+        """return pandas series of device ids indexed by keys, create missing ones in db"""
+        if not isinstance(keys, pd.MultiIndex):
+            keys = pd.MultiIndex.from_tuples(list(keys), names=['ca', 'unit', 'scp'])
+        for attempt in range(self.retries):
+            missing = [k for k in keys if k not in self.devices]
+            if not missing:
+                break
+            try:
+                self._insert(missing)
+            except IntegrityError:
+                # inserted by another process in the meantime, reload and retry the rest
+                self.load()
+        else:
+            missing = [k for k in keys if k not in self.devices]
+            if missing:
+                raise RuntimeError("Could not create {} devices, e.g. {}".format(len(missing), missing[0]))
+        return pd.Series([self.devices[k] for k in keys], index=keys, name='device_id')
+
+    def station_ids(self, device_ids):
+        """return numpy array of station ids of resolved device ids"""
+        lookup = self.device_stations
+        return np.fromiter((lookup[d] for d in device_ids), dtype=np.int32, count=len(device_ids))
+
+
+def read_manifest(conn):
+    """return ingest table as {file_date: row dict}"""
+    table = Ingest.__table__
+    return {r['file_date']: dict(r) for r in conn.execute(select([table]))}
+
+
+def mark_ingest(conn, file_date, checksum, rows_in, rows_out, status, lines=0):
+    """record ingest state of a data file"""
+    table = Ingest.__table__
+    conn.execute(table.delete().where(table.c.file_date == int(file_date)))
+    conn.execute(table.insert(), {'file_date': int(file_date), 'checksum': checksum, 'rows_in': int(rows_in),
+                                  'rows_out': int(rows_out), 'status': status, 'lines': int(lines)})
+
+
+def clear_rollups(conn, file_dates):
+    """remove rollup rows of given data files, before they are (re)loaded"""
+    for model, _ in ROLLUPS.values():
+        table = model.__table__
+        conn.execute(table.delete().where(table.c.file_date.in_([int(d) for d in file_dates])))
+
+
+def update_rollups(conn, df):
+    """add decumulated readings (station_id, timestamp, entry, exit, file_date) to the
+        hourly and daily station rollups, a reading counts in the hour/day of its timestamp
+    """
+    if not len(df):
+        return
+    insert = _upsert_insert(conn)
+    for model, seconds in ROLLUPS.values():
+        table = model.__table__
+        keys = ['station_id', 'timestamp', 'file_date']
+        agg = (df.assign(timestamp=df['timestamp'] - df['timestamp'] % seconds)
+                 .groupby(keys, sort=False)[['entry', 'exit']].sum().reset_index())
+        if insert is not None:
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=keys,
+                set_={c: table.c[c] + stmt.excluded[c] for c in ['entry', 'exit']})
+            conn.execute(stmt, agg.astype(np.int64).to_dict(orient='records'))
+            continue
+        # add to existing rows in pandas, then replace them
+        rows = []
+        for ids in chunks(agg['station_id'].unique().tolist()):
+            rows += conn.execute(select([table]).where(table.c.station_id.in_([int(i) for i in ids]) &
+                                                       table.c.file_date.in_(agg['file_date'].unique().tolist()))).fetchall()
+        old = pd.DataFrame.from_records(rows, columns=[c.name for c in table.columns])
+        if len(old):
+            agg = pd.concat([agg, old[keys + ['entry', 'exit']]]).groupby(keys)[['entry', 'exit']].sum().reset_index()
+            for ids in chunks(old['id'].tolist()):
+                conn.execute(table.delete().where(table.c.id.in_(ids)))
+        conn.execute(table.insert(), agg.astype(np.int64).to_dict(orient='records'))
+
+
+def read_rollup(conn, freq='day', start=None, end=None, station_ids=None):
+    """return station entries/exits per hour or day from the rollup tables
+        freq: 'hour' or 'day'
+        start, end: seconds since epoch, start inclusive, end exclusive
+        station_ids: restrict to these stations, default all
+        columns: station_id, timestamp, entry, exit, summed over data files
+    """
+    model, _ = ROLLUPS[freq]
+    table = model.__table__
+    query = select([table.c.station_id, table.c.timestamp,
+                    func.sum(table.c.entry).label('entry'), func.sum(table.c.exit).label('exit')])
+    if start is not None:
+        query = query.where(table.c.timestamp >= int(start))
+    if end is not None:
+        query = query.where(table.c.timestamp < int(end))
+    if station_ids is not None:
+        query = query.where(table.c.station_id.in_([int(i) for i in station_ids]))
+    query = (query.group_by(table.c.station_id, table.c.timestamp)
+                  .order_by(table.c.station_id, table.c.timestamp))
+    return pd.DataFrame.from_records(conn.execute(query).fetchall(),
+                                     columns=['station_id', 'timestamp', 'entry', 'exit'])
@@ -1,14 +1,37 @@
 import os
+import io
 import sys
+import gzip
+import lzma
+import shutil
+import hashlib
 import pandas as pd
 import logging
 from datetime import datetime
 
-from .sqlalchemy_declarative import Station, data_frame
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.types import INTEGER
-from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import create_engine
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .sqlalchemy_declarative import Station, read_rollup
+from sqlalchemy import create_engine, select, bindparam
+
+# raw data file compression -> file suffix
+COMPRESSIONS = {'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+DATA_REGEX = r'turnstile_\d{6}\.txt(\.gz|\.xz|\.zst)?$'
+EPOCH = pd.Timestamp(1970, 1, 1) # turnstile timestamps are seconds since EPOCH, local time
+
+# mapping file column -> station column
+MAPPING_COLUMNS = {
+    'Booth': 'ca',
+    'Remote': 'unit',
+    'Station': 'name',
+    'Line Name': 'line',
+    'Division': 'division',
+    'Latitude': 'latitude',
+    'Longitude': 'longitude',
+}
 
 def createLogger(prefix, log_path=None):
     """create logging instance"""
@@ -36,6 +59,49 @@ def parseDate(name):
 def filterUrl(urls, date_range):
     return [u for u in urls if parseDate(u) >= date_range[0] and parseDate(u) <= date_range[1]]
 
+def requireZstd():
+    if zstandard is None:
+        raise ImportError("zstd compressed files require zstandard: pip install zstandard")
+
+def openFile(path, mode='r'):
+    """open plain or compressed (by suffix) data file for streaming reads, mode 'r' (text) or 'rb'"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode if mode == 'rb' else 'rt')
+    if path.endswith('.xz'):
+        return lzma.open(path, mode if mode == 'rb' else 'rt')
+    if path.endswith('.zst'):
+        requireZstd()
+        f = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return f if mode == 'rb' else io.TextIOWrapper(f)
+    return open(path, mode)
+
+def compressFile(path, compression, level=None):
+    """compress file into path + suffix of compression ('gzip', 'xz' or 'zstd'), remove the original,
+        return new path
+    """
+    target = path + COMPRESSIONS[compression]
+    with open(path, 'rb') as src, open(target + '.tmp', 'wb') as raw:
+        if compression == 'zstd':
+            requireZstd()
+            with zstandard.ZstdCompressor(level=level or 3).stream_writer(raw, closefd=False) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+        else:
+            opener = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level or 6) if compression == 'gzip' \
+                else lzma.LZMAFile(raw, 'wb', preset=level)
+            with opener as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(target + '.tmp', target)
+    os.remove(path)
+    return target
+
+def fileChecksum(path):
+    """sha256 hex digest of (decompressed) file content"""
+    h = hashlib.sha256()
+    with openFile(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
 def createPath(path):
     if not os.path.isdir(path):
         try:
@@ -44,35 +110,72 @@ def createPath(path):
             raise e
     return path
 
+def readMapping(file_path):
+    """read geocoded Remote-Booth-Station mapping from .csv or .xlsx, one row per (ca, unit)"""
+    if file_path.lower().endswith('.csv'):
+        df_map = pd.read_csv(file_path, dtype={'Booth': str, 'Remote': str})
+    else:
+        df_map = pd.read_excel(file_path, dtype={'Booth': str, 'Remote': str})
+    df_map = df_map.rename(columns=MAPPING_COLUMNS)[['ca', 'unit'] + list(MAPPING_COLUMNS.values())[2:]]
+    df_map['ca'] = df_map['ca'].str.strip()
+    df_map['unit'] = df_map['unit'].str.strip()
+    return df_map.dropna(subset=['ca', 'unit']).drop_duplicates(['ca', 'unit'], keep='last')
+
 def station_mapping(file_path, dbstring):
-    # read geocoded Remote-Booth-Station.xlsx file
+    # read geocoded Remote-Booth-Station.xlsx (or .csv) file
     # Thanks to Chris Whong and Mala Hertz for mapping Remote Unit with the Latitude/Longitude
     # repo here: https://github.com/chriswhong/nycturnstiles
     if not os.path.isfile(file_path):
         print("Mapping file not found.")
         sys.exit(1)
-    df_map = pd.read_excel(file_path)
-    print(df_map.head())
+    df_map = readMapping(file_path)
 
-    # connect to db and read in Station table
+    # join mapping against station table in memory
     engine = create_engine(dbstring)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    #df_station = data_frame(session.query(Station), ['id', 'ca', 'unit'])
-    #print(df_station.head())
+    table = Station.__table__
+    with engine.connect() as conn:
+        df_station = pd.DataFrame.from_records(
+            conn.execute(select([table.c.id, table.c.ca, table.c.unit])).fetchall(),
+            columns=['_id', 'ca', 'unit'])
+    df = df_station.merge(df_map, on=['ca', 'unit'], how='inner')
+    df = df.drop(['ca', 'unit'], axis=1).astype(object)
+    records = df.where(df.notnull(), None).to_dict(orient='records')
 
-    for _, row in df_map.iterrows():
-        try:
-            obj = session.query(Station).filter(Station.ca==row['Booth']).filter(Station.unit==row['Remote']).one()
-            obj.name = row['Station']
-            obj.line = row['Line Name']
-            obj.division = row['Division']
-            obj.latitude = row['Latitude']
-            obj.longitude = row['Longitude']
-            session.commit()
-        except NoResultFound:
-            pass
-
-    session.close()
-
-    print("Geomapped station table udpated.")
\ No newline at end of file
+    # one executemany update in a single transaction
+    if records:
+        with engine.begin() as conn:
+            conn.execute(table.update().where(table.c.id == bindparam('_id')), records)
+    engine.dispose()
+
+    matched = len(records)
+    print("Geomapped station table updated: {} stations matched, {} stations unmatched, "
+          "{} mapping rows unmatched.".format(matched, len(df_station) - matched, len(df_map) - matched))
+    return matched, len(df_station) - matched
+
+def station_series(dbstring, date_range, stations=None, freq='day'):
+    """station entries/exits per hour or day, read from the rollup tables kept by Cleaner
+        date_range: (start_date(str), end_date(str)), yyyy-mm-dd, both days included
+        stations: station ids or (ca, unit) pairs, default all stations
+        freq: 'hour' or 'day'
+        return dataframe of station_id, ca, unit, name, timestamp(datetime), entry, exit
+    """
+    start = pd.Timestamp(date_range[0])
+    end = pd.Timestamp(date_range[1]) + pd.Timedelta(days=1)
+    second = pd.Timedelta(seconds=1)
+    engine = create_engine(dbstring)
+    table = Station.__table__
+    with engine.connect() as conn:
+        df_station = pd.DataFrame.from_records(
+            conn.execute(select([table.c.id, table.c.ca, table.c.unit, table.c.name]).order_by(table.c.id)).fetchall(),
+            columns=['station_id', 'ca', 'unit', 'name'])
+        station_ids = None
+        if stations is not None:
+            pairs = set(s for s in stations if isinstance(s, tuple))
+            station_ids = [s for s in stations if not isinstance(s, tuple)]
+            station_ids += [i for i, ca, unit in df_station[['station_id', 'ca', 'unit']].values
+                            if (ca, unit) in pairs]
+        df = read_rollup(conn, freq, (start - EPOCH) // second, (end - EPOCH) // second, station_ids)
+    engine.dispose()
+    df['timestamp'] = EPOCH + pd.to_timedelta(df['timestamp'], unit='s')
+    return df_station.merge(df, on='station_id', how='inner')[
+        ['station_id', 'ca', 'unit', 'name', 'timestamp', 'entry', 'exit']]
@@ -0,0 +1,134 @@
+"""
+    Bulk writers for the turnstile table
+    generic: chunked executemany through sqlalchemy, works with any database
+    sqlite: tuple executemany on the raw connection, tuned PRAGMAs
+    postgresql: COPY FROM STDIN from an in-memory csv buffer (psycopg2)
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+import io
+import time
+from sqlalchemy import event
+from .sqlalchemy_declarative import Turnstile
+
+COLUMNS = [c.name for c in Turnstile.__table__.columns if c.name != 'id']
+
+
+class TurnstileWriter:
+    """generic writer, insert rows in chunks through sqlalchemy core
+        write() takes a connection inside the caller's transaction, commit is left to the caller
+    """
+    name = 'generic'
+
+    def __init__(self, chunk_size=10000):
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.seconds = 0.0
+
+    def configure(self, engine):
+        """hook to tune connections of the engine before first use"""
+        pass
+
+    def rows_of(self, df):
+        """turnstile columns of df as list of tuples of python values"""
+        df = df.astype({'device_id': 'int64', 'timestamp': 'int64', 'entry': 'int64', 'exit': 'int64'})
+        return list(zip(*[df[c].tolist() for c in COLUMNS]))
+
+    def _write(self, conn, df):
+        rows = [dict(zip(COLUMNS, r)) for r in self.rows_of(df)]
+        for i in range(0, len(rows), self.chunk_size):
+            conn.execute(Turnstile.__table__.insert(), rows[i:i+self.chunk_size])
+
+    def write(self, conn, df):
+        """insert decumulated dataframe, return number of rows written"""
+        if df.empty:
+            return 0
+        start = time.perf_counter()
+        self._write(conn, df)
+        self.seconds += time.perf_counter() - start
+        self.rows += len(df)
+        return len(df)
+
+    def rate(self):
+        """rows per second over all writes so far"""
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def report(self):
+        return "Writer {0}: {1} rows in {2:.2f}s ({3:.0f} rows/sec).".format(
+            self.name, self.rows, self.seconds, self.rate())
+
+
+class SQLiteWriter(TurnstileWriter):
+    """sqlite writer, one executemany of tuples per chunk on the dbapi cursor"""
+    name = 'sqlite'
+    PRAGMAS = [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA cache_size=-65536', # 64MB
+    ]
+
+    def __init__(self, chunk_size=100000):
+        TurnstileWriter.__init__(self, chunk_size)
+
+    def configure(self, engine):
+        def set_pragmas(dbapi_conn, record):
+            cursor = dbapi_conn.cursor()
+            for pragma in self.PRAGMAS:
+                cursor.execute(pragma)
+            cursor.close()
+        event.listen(engine, 'connect', set_pragmas)
+
+    def _write(self, conn, df):
+        sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            Turnstile.__tablename__, ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+        rows = self.rows_of(df)
+        cursor = conn.connection.cursor()
+        try:
+            for i in range(0, len(rows), self.chunk_size):
+                cursor.executemany(sql, rows[i:i+self.chunk_size])
+        finally:
+            cursor.close()
+
+
+class PostgresWriter(TurnstileWriter):
+    """postgresql writer, COPY FROM STDIN per chunk, needs psycopg2 (copy_expert)
+        falls back to the generic path with other drivers
+    """
+    name = 'postgresql'
+
+    def __init__(self, chunk_size=500000):
+        TurnstileWriter.__init__(self, chunk_size)
+
+    def _write(self, conn, df):
+        cursor = conn.connection.cursor()
+        if not hasattr(cursor, 'copy_expert'):
+            cursor.close()
+            return TurnstileWriter._write(self, conn, df)
+        sql = 'COPY {0} ({1}) FROM STDIN WITH (FORMAT csv)'.format(Turnstile.__tablename__, ', '.join(COLUMNS))
+        df = df[COLUMNS].astype({'device_id': 'int64', 'timestamp': 'int64', 'entry': 'int64', 'exit': 'int64'})
+        try:
+            for i in range(0, len(df), self.chunk_size):
+                buf = io.StringIO()
+                df.iloc[i:i+self.chunk_size].to_csv(buf, header=False, index=False)
+                buf.seek(0)
+                cursor.copy_expert(sql, buf)
+        finally:
+            cursor.close()
+
+
+WRITERS = {w.name: w for w in (TurnstileWriter, SQLiteWriter, PostgresWriter)}
+
+
+def get_writer(engine, writer=None):
+    """return writer instance
+        writer: None (pick by database dialect), a name in WRITERS, a writer class or instance
+    """
+    if writer is None:
+        writer = WRITERS.get(engine.dialect.name, TurnstileWriter)
+    elif not isinstance(writer, TurnstileWriter) and not isinstance(writer, type):
+        writer = WRITERS[writer]
+    if isinstance(writer, type):
+        writer = writer()
+    writer.configure(engine)
+    return writer
@@ -23,5 +23,7 @@ setup(name='pymtattl',
         'Topic :: Education',
       ],
       packages=['pymtattl'],
-      install_requires=['beautifulsoup4', 'pandas', 'sqlalchemy'],
+      install_requires=['beautifulsoup4', 'pandas', 'sqlalchemy>=1.4,<2.0'],
+      extras_require={'parquet': ['pyarrow'], 'zstd': ['zstandard']},
+      entry_points={'console_scripts': ['pymtattl-ingest = pymtattl.ingest:main']},
       )